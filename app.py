@@ -1,8 +1,21 @@
-import openai
+import asyncio
+import atexit
+import concurrent.futures
+import os
+import pickle
+import threading
+import time
+import numpy as np
+import orjson
 import streamlit as st
+from collections import OrderedDict
+from openai import AsyncOpenAI
 from datetime import datetime
 import requests
-import base64
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from scoring import QUESTIONS, build_rating_request, parse_ratings, truncate_answer, calculate_final_score
 
 # =========================
 # 1) Set up credentials
@@ -13,93 +26,259 @@ import base64
 #   GH_TOKEN: your GitHub personal access token
 #   GH_OWNER: the GitHub username or org that owns the repo
 #   GH_REPO: the name of the repo (public)
+#   GH_BRANCH (optional): the branch to push to; defaults to the repo's default branch
 #
-openai.api_key = st.secrets["OPENAI_API_KEY"]
+OPENAI_API_KEY = st.secrets["OPENAI_API_KEY"]
 GH_TOKEN = st.secrets["GH_TOKEN"]
 GH_OWNER = st.secrets["GH_OWNER"]
 GH_REPO = st.secrets["GH_REPO"]
+GH_BRANCH = st.secrets.get("GH_BRANCH")
 
 # =========================
 # 2) Intellectual Humility
 # =========================
-QUESTIONS = [
-    "Can you describe a time you realized you were wrong about something important? How did you come to that realization, and what did you do afterward?",
-    "What’s a topic you used to feel very certain about, but now feel less certain—or even uncertain—about? What made you reconsider?",
-    "When you’re in a debate and you encounter evidence that contradicts your view, how do you usually respond?",
-    "In areas you’re most knowledgeable about, do you ever worry that you might still have blind spots? How do you watch out for them?",
-    "How do you decide which sources of information you trust and which you don’t?"
-    # "I enjoy learning from people whose opinions differ from mine.",
-    # "I find it easy to admit when I’m wrong.",
-    # "I’m open to revisiting and potentially changing my core beliefs.",
-    # "I often seek feedback and constructive criticism.",
-    # "I quickly dismiss opposing viewpoints.",  # reverse scored
-    # "I find it difficult to say 'I don’t know.'",  # reverse scored
-    # "I value expertise in areas where I’m not knowledgeable.",
-    # "I try to see issues from multiple perspectives.",
-    # "It is important to me to be right, even if evidence suggests otherwise.",  # reverse scored
-    # "I regularly reflect on how my beliefs may be biased or incomplete."
-]
-REVERSE_SCORED = []
-# REVERSE_SCORED = [4, 5, 8]  # 0-based indices for Q5, Q6, Q9
-
-def interpret_answer_with_chatgpt(question, user_answer):
-    """
-    Use the ChatCompletion API to interpret user's answer on a 1–5 scale
-    where 1 = strongly indicates humility, 5 = strongly indicates lack of humility.
-    """
-    system_message = (
-        "You are a helpful assistant. You will be given a question that should help you identify intellectual humility "
-        "and the user's answer. Use the following definition of intellectual humility: Intellectual humility is the "
-        "recognition that our knowledge and understanding are always limited and subject to growth or change." 
-        "It involves acknowledging that we can be wrong, while staying open to learning from new information or perspectives."
-        "Individuals who exhibit intellectual humility demonstrate curiosity, actively seeking out opposing viewpoints to refine their own thinking."
-        "They also tend to be self-reflective about their cognitive biases and willing to correct mistakes in pursuit of truth."
-        "In essence, intellectual humility emphasizes understanding over ego, valuing the collaborative search for accuracy above the need to be right."
-        "Your task: interpret how the user’s answer reflects "
-        "their intellectual humility on a 1–5 scale, with 1 = strongly indicates lack of humility "
-        "and 5 = strongly indicates humility."
-    )
-    user_prompt = (
-        f"Question: {question}\n"
-        f"User's answer: '{user_answer}'\n\n"
-        "Please respond ONLY with a single integer from 1 to 5."
-    )
+# Maximum number of (question, answer) ratings kept in the rating cache,
+# and how many seconds each one stays valid
+RATING_CACHE_SIZE = 1024
+RATING_CACHE_TTL = 86400
 
-    response = openai.ChatCompletion.create(
-        model="gpt-3.5-turbo",
-        messages=[
-            {"role": "system", "content": system_message},
-            {"role": "user", "content": user_prompt},
-        ],
-        temperature=0.0
+# Answers whose embedding is at least this cosine-similar to an earlier answer
+# to the same question reuse that answer's rating instead of calling ChatCompletion
+# cost: every submission that isn't fully served by the exact-match cache makes an
+# embeddings request before the chat request, i.e. one extra round trip in series
+EMBEDDING_MODEL = "text-embedding-3-small"
+SEMANTIC_SIMILARITY_THRESHOLD = 0.92
+SEMANTIC_CACHE_PATH = "semantic_cache.pkl"
+# Most recent answers kept per question; older rows are dropped first
+SEMANTIC_CACHE_SIZE = 512
+# Minimum seconds between writes of the semantic cache to disk
+SEMANTIC_CACHE_SAVE_INTERVAL = 300
+
+def make_openai_client():
+    """
+    Build an AsyncOpenAI client for one submission. Its embeddings and chat
+    requests run one after the other and reuse a single keep-alive connection.
+    The connection pool is tied to the event loop it is used on, so a client is
+    made per submission rather than cached.
+    """
+    return AsyncOpenAI(api_key=OPENAI_API_KEY)
+
+async def interpret_all_answers(client, questions, answers):
+    """
+    Use a single streamed ChatCompletion request to interpret every answer.
+    Returns one rating per question, in question order, with None wherever the
+    model's reply could not be parsed.
+    """
+    stream = await client.chat.completions.create(
+        **build_rating_request(questions, answers),
+        stream=True
     )
 
-    raw_answer = response["choices"][0]["message"]["content"].strip()
+    # Collect digit tokens as they arrive and stop as soon as every answer has one
+    raw_answer = ""
+    async for chunk in stream:
+        if chunk.choices:
+            raw_answer += chunk.choices[0].delta.content or ""
+        if len(raw_answer.strip()) >= len(questions):
+            break
+    await stream.close()
+
+    return parse_ratings(raw_answer, len(questions))
+
+@st.cache_resource
+def get_rating_cache():
+    """
+    Process-wide LRU cache of (rating, expiry time) keyed on
+    (question, normalized answer), shared by every session so repeated
+    answers skip the API entirely.
+    """
+    return OrderedDict()
+
+@st.cache_resource
+def get_rating_cache_lock():
+    """
+    Lock serializing access to the rating cache across sessions.
+    """
+    return threading.Lock()
+
+def get_cached_ratings(keys):
+    """
+    Return the cached rating for each key, or None if it is missing or expired.
+    """
+    cache = get_rating_cache()
+    now = time.monotonic()
+    ratings = []
+    with get_rating_cache_lock():
+        for key in keys:
+            entry = cache.get(key)
+            if entry is None or entry[1] <= now:
+                cache.pop(key, None)
+                ratings.append(None)
+                continue
+            cache.move_to_end(key)
+            ratings.append(entry[0])
+    return ratings
+
+def cache_ratings(items):
+    """
+    Store (key, rating) items in the rating cache for RATING_CACHE_TTL seconds,
+    evicting the least recently used entries beyond RATING_CACHE_SIZE.
+    """
+    cache = get_rating_cache()
+    expires_at = time.monotonic() + RATING_CACHE_TTL
+    with get_rating_cache_lock():
+        for key, rating in items:
+            cache[key] = (rating, expires_at)
+            cache.move_to_end(key)
+        while len(cache) > RATING_CACHE_SIZE:
+            cache.popitem(last=False)
 
+@st.cache_resource
+def get_semantic_cache():
+    """
+    Load the semantic rating cache from disk. Maps each question to an
+    (N, dim) float32 array of unit-length answer embeddings and the list of
+    N ratings those answers were given.
+    """
     try:
-        rating = int(raw_answer)
-        if rating < 1 or rating > 5:
-            rating = 3  # fallback
-    except ValueError:
-        rating = 3  # fallback
+        with open(SEMANTIC_CACHE_PATH, "rb") as f:
+            return pickle.load(f)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        return {}
+
+@st.cache_resource
+def get_semantic_cache_state():
+    """
+    Shared state for the semantic cache: the cache itself, a lock serializing
+    updates and the time it was last written to disk. Pending updates are also
+    written when the process exits, from the cache held here so the exit hook
+    never goes back through Streamlit's resource cache.
+    """
+    state = {
+        "cache": get_semantic_cache(),
+        "lock": threading.Lock(),
+        "last_saved": time.monotonic(),
+        "dirty": False
+    }
+    atexit.register(save_semantic_cache, state)
+    return state
+
+def save_semantic_cache(state):
+    """
+    Write the semantic cache to SEMANTIC_CACHE_PATH if it changed since the
+    last write. Callers must not hold the lock in `state`.
+    """
+    with state["lock"]:
+        if not state["dirty"]:
+            return
+        # Write to a temporary file first so a crash never leaves a truncated cache
+        tmp_path = f"{SEMANTIC_CACHE_PATH}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(state["cache"], f)
+        os.replace(tmp_path, SEMANTIC_CACHE_PATH)
+        state["last_saved"] = time.monotonic()
+        state["dirty"] = False
+
+async def embed_answers(client, answers):
+    """
+    Embed answers in one Embedding request and return a (len(answers), dim)
+    float32 array of unit-length rows, so dot products are cosine similarities.
+    Identical answers (e.g. the same "I agree" to several questions) are only
+    sent once.
+    """
+    unique_answers = list(dict.fromkeys(answers))
+    response = await client.embeddings.create(model=EMBEDDING_MODEL, input=unique_answers)
+    embeddings = np.array([item.embedding for item in response.data], dtype=np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    row_of = {answer: row for row, answer in enumerate(unique_answers)}
+    return embeddings[[row_of[answer] for answer in answers]]
+
+def lookup_semantic_cache(question, embedding):
+    """
+    Return the cached rating of the most similar earlier answer to `question`,
+    or None if no earlier answer reaches SEMANTIC_SIMILARITY_THRESHOLD.
+    """
+    entry = get_semantic_cache_state()["cache"].get(question)
+    if entry is None:
+        return None
+    embeddings, ratings = entry
+    similarities = embeddings @ embedding
+    best = int(np.argmax(similarities))
+    if similarities[best] >= SEMANTIC_SIMILARITY_THRESHOLD:
+        return ratings[best]
+    return None
+
+def add_to_semantic_cache(new_entries):
+    """
+    Add (question, embedding, rating) entries to the semantic cache, keeping the
+    newest SEMANTIC_CACHE_SIZE per question, and persist it to SEMANTIC_CACHE_PATH
+    at most once every SEMANTIC_CACHE_SAVE_INTERVAL seconds.
+    """
+    state = get_semantic_cache_state()
+    cache = state["cache"]
+    with state["lock"]:
+        for question, embedding, rating in new_entries:
+            embeddings, ratings = cache.get(
+                question, (np.empty((0, embedding.shape[0]), dtype=np.float32), [])
+            )
+            # Drop the oldest rows so the copy below stays bounded
+            start = max(0, len(ratings) - (SEMANTIC_CACHE_SIZE - 1))
+            cache[question] = (
+                np.vstack([embeddings[start:], embedding]),
+                ratings[start:] + [rating]
+            )
+        state["dirty"] = True
+        save_due = time.monotonic() - state["last_saved"] >= SEMANTIC_CACHE_SAVE_INTERVAL
 
-    return rating
+    if save_due:
+        save_semantic_cache(state)
 
-def calculate_final_score(ratings):
+async def rate_answers(questions, answers):
     """
-    Convert a list of 10 numeric ratings (1–5) into an overall humility
-    score (1–10), accounting for reverse-scoring on certain items.
+    Return one 1–5 rating per question. Answers already in the rating cache are
+    served from it, then answers close enough to an earlier answer to the same
+    question reuse its rating; the rest are interpreted together in one request.
     """
-    total_score = 0
-    for i, rating in enumerate(ratings):
-        if i in REVERSE_SCORED:
-            # Invert (1->5, 5->1, etc.)
-            rating = 6 - rating
-        total_score += rating
+    answers = [truncate_answer(answer) for answer in answers]
+    keys = [(question, answer.strip().lower()) for question, answer in zip(questions, answers)]
+    ratings = get_cached_ratings(keys)
+    new_cache_items = []
+
+    missing = [i for i, rating in enumerate(ratings) if rating is None]
+    if missing:
+        async with make_openai_client() as client:
+            embeddings = await embed_answers(client, [answers[i] for i in missing])
+
+            to_interpret = []
+            for i, embedding in zip(missing, embeddings):
+                rating = lookup_semantic_cache(questions[i], embedding)
+                if rating is None:
+                    to_interpret.append((i, embedding))
+                    continue
+                ratings[i] = rating
+                new_cache_items.append((keys[i], rating))
+
+            if to_interpret:
+                new_ratings = await interpret_all_answers(
+                    client,
+                    [questions[i] for i, _ in to_interpret],
+                    [answers[i] for i, _ in to_interpret],
+                )
+                new_entries = []
+                for (i, embedding), rating in zip(to_interpret, new_ratings):
+                    if rating is None:
+                        ratings[i] = 3  # fallback, not cached so the next submission retries
+                        continue
+                    ratings[i] = rating
+                    new_cache_items.append((keys[i], rating))
+                    new_entries.append((questions[i], embedding, rating))
+                if new_entries:
+                    add_to_semantic_cache(new_entries)
+
+    cache_ratings(new_cache_items)
 
-    # Now map total_score (10–50) to a scale of 1–10
-    final_score = (total_score / 25) * 10
-    return round(final_score, 1)
+    return ratings
 
 def provide_recommendations(score):
     """
@@ -133,46 +312,106 @@ def provide_recommendations(score):
 # =========================
 # 3) Pushing to GitHub
 # =========================
+@st.cache_resource
+def get_github_session(token: str):
+    """
+    Return a requests Session for the GitHub API with auth headers set. It is
+    shared across reruns so the TLS connection is kept alive between pushes,
+    and retries transient 5xx responses with backoff.
+    """
+    session = requests.Session()
+    retries = Retry(total=3, backoff_factor=1, status_forcelist=[502, 503, 504])
+    session.mount("https://", HTTPAdapter(max_retries=retries))
+    session.headers.update({
+        "Authorization": f"token {token}",
+        "Accept": "application/vnd.github.v3+json",
+        "Content-Type": "application/json"
+    })
+    return session
+
+# Seconds to wait for the background GitHub push before leaving it to finish on its own
+GITHUB_PUSH_TIMEOUT = 15
+
+@st.cache_resource
+def get_push_executor():
+    """
+    Return the thread pool that pushes responses to GitHub in the background,
+    shared across reruns and sessions.
+    """
+    return concurrent.futures.ThreadPoolExecutor(max_workers=2)
+
+def github_request(session, method: str, url: str, payload: dict = None):
+    """
+    Send one GitHub API request and return the decoded JSON response,
+    raising requests.HTTPError on a non-2xx status.
+    """
+    # Serialize with orjson straight to bytes; the session already sends Content-Type: application/json
+    body = None if payload is None else orjson.dumps(payload)
+    response = session.request(method, url, data=body, timeout=10)
+    response.raise_for_status()
+    return orjson.loads(response.content)
+
 def push_responses_to_github(
     owner: str, 
     repo: str, 
-    token: str, 
-    file_path: str, 
-    content: str, 
-    commit_message: str = "Add new responses file"
+    session: requests.Session, 
+    files: dict, 
+    commit_message: str = "Add new responses files",
+    branch: str = None,
+    max_attempts: int = 3
 ):
     """
-    Pushes a text file to a GitHub repo using the GitHub REST API.
+    Pushes text files to a GitHub repo in a single commit using the Git Data API.
+    This costs five sequential requests however many files are written (six if
+    `branch` has to be looked up), against one Contents API PUT per file, in
+    exchange for committing all files atomically.
     - `owner`: GitHub username/org
     - `repo`: Repository name
-    - `token`: Personal Access Token with 'repo' scope
-    - `file_path`: The path in the repo where the file will be created, e.g. "responses/..."
-    - `content`: The raw text content to write
+    - `session`: GitHub session from get_github_session; resolved by the caller
+      because this may run on a worker thread without a Streamlit script context
+    - `files`: Mapping of path in the repo, e.g. "responses/...", to raw text content
     - `commit_message`: The commit message
+    - `branch`: The branch to commit to; defaults to the repo's default branch
+    - `max_attempts`: How many times to retry if another push moved the branch first
     """
-    # Endpoint to create or update file content:
-    # https://api.github.com/repos/{owner}/{repo}/contents/{path}
-    url = f"https://api.github.com/repos/{owner}/{repo}/contents/{file_path}"
+    # Endpoints live under https://api.github.com/repos/{owner}/{repo}/git/
+    api_url = f"https://api.github.com/repos/{owner}/{repo}/git"
 
-    # Must base64-encode the content
-    encoded_bytes = base64.b64encode(content.encode("utf-8"))
-    encoded_str = encoded_bytes.decode("utf-8")
+    for attempt in range(max_attempts):
+        try:
+            if branch is None:
+                repo_info = github_request(session, "GET", f"https://api.github.com/repos/{owner}/{repo}")
+                branch = repo_info["default_branch"]
+            head = github_request(session, "GET", f"{api_url}/ref/heads/{branch}")
+            parent_sha = head["object"]["sha"]
+            parent = github_request(session, "GET", f"{api_url}/commits/{parent_sha}")
 
-    data = {
-        "message": commit_message,
-        "content": encoded_str
-    }
-
-    headers = {
-        "Authorization": f"token {token}",
-        "Accept": "application/vnd.github.v3+json"
-    }
-
-    response = requests.put(url, json=data, headers=headers)
-    if response.status_code in [200, 201]:
-        return True, response.json()
-    else:
-        return False, response.text
+            # Text files can go inline in the tree, which saves a blob request per file
+            tree = github_request(session, "POST", f"{api_url}/trees", {
+                "base_tree": parent["tree"]["sha"],
+                "tree": [
+                    {"path": path, "mode": "100644", "type": "blob", "content": content}
+                    for path, content in files.items()
+                ]
+            })
+            commit = github_request(session, "POST", f"{api_url}/commits", {
+                "message": commit_message,
+                "tree": tree["sha"],
+                "parents": [parent_sha]
+            })
+            ref = github_request(session, "PATCH", f"{api_url}/refs/heads/{branch}", {
+                "sha": commit["sha"]
+            })
+            return True, ref
+        except requests.HTTPError as e:
+            # 422 on the ref update means the branch moved since we read it; start over.
+            # A 422 from the tree or commit POST is a validation error that retrying won't fix
+            moved = e.response.status_code == 422 and e.response.request.method == "PATCH"
+            if moved and attempt < max_attempts - 1:
+                continue
+            return False, e.response.text
+        except requests.RequestException as e:
+            return False, str(e)
 
 def main():
     st.title("Intellectual Humility Open Ended Questions (GitHub Integration)")
@@ -182,30 +421,25 @@ def main():
         "we'll compute an intellectual humility score and push your responses to a private GitHub repo."
     )
 
-    # 1) Collect user answers
-    user_answers = []
-    for i, question in enumerate(QUESTIONS):
-        st.write(f"**Question {i+1}:** {question}")
-        answer = st.text_area(f"Your answer to Q{i+1}:", key=f"answer_{i}")
-        user_answers.append(answer)
-
-    # 2) Button to process
-    if st.button("Submit All Answers and Calculate Score"):
-        user_ratings = []
+    # 1) Collect user answers in a form so edits don't rerun the script until submit
+    with st.form("answers"):
+        user_answers = []
         for i, question in enumerate(QUESTIONS):
-            answer_text = user_answers[i].strip()
-            if not answer_text:
-                answer_text = "No answer provided."
-            with st.spinner(f"Interpreting your answer for Question {i+1}..."):
-                rating = interpret_answer_with_chatgpt(question, answer_text)
-            user_ratings.append(rating)
+            st.write(f"**Question {i+1}:** {question}")
+            answer = st.text_area(f"Your answer to Q{i+1}:", key=f"answer_{i}")
+            user_answers.append(answer)
+
+        # 2) Button to process
+        submitted = st.form_submit_button("Submit All Answers and Calculate Score")
+
+    if submitted:
+        answer_texts = [answer.strip() or "No answer provided." for answer in user_answers]
+        with st.spinner("Interpreting your answers..."):
+            user_ratings = asyncio.run(rate_answers(QUESTIONS, answer_texts))
 
         final_score = calculate_final_score(user_ratings)
         advice = provide_recommendations(final_score)
 
-        st.subheader(f"Your Intellectual Humility Score: {final_score}/10")
-        st.write(advice)
-
         # 3) Build content to push
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         file_name = f"responses_{timestamp}.txt"
@@ -222,16 +456,27 @@ def main():
         # You can choose any subfolder in your repo, e.g. "responses/"
         file_path_in_repo = f"responses/{file_name}"
 
-        st.write("Pushing your responses to GitHub... please wait.")
-        success, gh_response = push_responses_to_github(
+        # Push in the background so the score renders while the request is in flight
+        push_future = get_push_executor().submit(
+            push_responses_to_github,
             owner=GH_OWNER,
             repo=GH_REPO,
-            token=GH_TOKEN,
-            file_path=file_path_in_repo,
-            content=file_text,
-            commit_message=f"Add responses file {file_name}"
+            session=get_github_session(GH_TOKEN),
+            files={file_path_in_repo: file_text},
+            commit_message=f"Add responses file {file_name}",
+            branch=GH_BRANCH
         )
 
+        st.subheader(f"Your Intellectual Humility Score: {final_score}/10")
+        st.write(advice)
+
+        with st.spinner("Pushing your responses to GitHub... please wait."):
+            try:
+                success, gh_response = push_future.result(timeout=GITHUB_PUSH_TIMEOUT)
+            except concurrent.futures.TimeoutError:
+                st.warning("Pushing your responses to GitHub is taking a while; it will finish in the background.")
+                return
+
         if success:
             st.success(f"Successfully pushed your responses to GitHub at {file_path_in_repo}.")
         else:
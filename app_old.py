@@ -1,8 +1,13 @@
-import openai
+import asyncio
+import httpx
+import numpy as np
 import streamlit as st
+from openai import AsyncOpenAI
+
+from scoring import CHAT_MODEL, RATING_TOKEN_IDS, truncate_answer
 
 # Our 10 questions
-QUESTIONS = [
+QUESTIONS = (
     "I enjoy learning from people whose opinions differ from mine.",
     "I find it easy to admit when I’m wrong.",
     "I’m open to revisiting and potentially changing my core beliefs.",
@@ -13,57 +18,98 @@ QUESTIONS = [
     "I try to see issues from multiple perspectives.",
     "It is important to me to be right, even if evidence suggests otherwise.",  # reverse scored
     "I regularly reflect on how my beliefs may be biased or incomplete."
-]
+)
+
+REVERSE_SCORED = frozenset({4, 5, 8})  # 0-based indices for Q5, Q6, Q9
+
+SYSTEM_MESSAGE = (
+    "You are a helpful assistant. You will be given a question about intellectual humility "
+    "and the user's answer. Your task: interpret how the user’s answer reflects "
+    "their intellectual humility on a 1–5 scale, with 1 = strongly indicates humility "
+    "and 5 = strongly indicates lack of humility."
+)
+
+# Boolean mask over question indices marking the reverse-scored items
+REVERSE_SCORED_MASK = np.zeros(len(QUESTIONS), dtype=bool)
+REVERSE_SCORED_MASK[list(REVERSE_SCORED)] = True
+
+# Upper bound on simultaneous ChatCompletion requests per submission
+MAX_CONCURRENT_REQUESTS = 10
 
-REVERSE_SCORED = [4, 5, 8]  # 0-based indices for Q5, Q6, Q9
+def make_openai_client():
+    """
+    Build an AsyncOpenAI client on an HTTP/2 connection pool, so the concurrent
+    requests of one submission share a single TLS connection.
+    """
+    return AsyncOpenAI(
+        api_key=st.secrets["OPENAI_API_KEY"],
+        http_client=httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=20)
+        )
+    )
 
-def interpret_answer_with_chatgpt(question, user_answer):
+async def interpret_answer_with_chatgpt(client, question, user_answer, semaphore):
     """
     Use the ChatCompletion API to interpret user's answer on a 1–5 scale
     where 1 = strongly indicates humility, 5 = strongly indicates lack of humility.
     """
-    system_message = (
-        "You are a helpful assistant. You will be given a question about intellectual humility "
-        "and the user's answer. Your task: interpret how the user’s answer reflects "
-        "their intellectual humility on a 1–5 scale, with 1 = strongly indicates humility "
-        "and 5 = strongly indicates lack of humility."
-    )
+    # Bound the input size no matter how much text was pasted
+    user_answer = truncate_answer(user_answer)
+
     user_prompt = (
         f"Question: {question}\n"
         f"User's answer: '{user_answer}'\n\n"
         f"Please respond ONLY with a single integer from 1 to 5 that best fits the user's answer."
     )
 
-    response = openai.ChatCompletion.create(
-        model="gpt-3.5-turbo",
-        messages=[
-            {"role": "system", "content": system_message},
-            {"role": "user", "content": user_prompt},
-        ],
-        temperature=0.0
-    )
+    # Cap this submission's in-flight requests; each submission runs its own event loop
+    # and semaphore, so this does not limit requests across concurrent submissions
+    async with semaphore:
+        stream = await client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=[
+                {"role": "system", "content": SYSTEM_MESSAGE},
+                {"role": "user", "content": user_prompt},
+            ],
+            temperature=0.0,
+            max_tokens=1,
+            logit_bias={token_id: 100 for token_id in RATING_TOKEN_IDS},
+            stream=True
+        )
 
-    raw_answer = response["choices"][0]["message"]["content"].strip()
+        # Stop at the first content token; the logit bias guarantees a single digit from 1 to 5
+        digit = ""
+        async for chunk in stream:
+            digit = (chunk.choices[0].delta.content or "") if chunk.choices else ""
+            if digit:
+                break
+        await stream.close()
 
-    try:
-        rating = int(raw_answer)
-        if rating < 1 or rating > 5:
-            rating = 3  # fallback
-    except:
-        rating = 3  # fallback
+    rating = int(digit) if digit else 3  # fallback if the stream ended empty
 
     return rating
 
+async def interpret_all_answers(questions, answers):
+    """
+    Interpret every answer concurrently and return the ratings in question order.
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    async with make_openai_client() as client:
+        tasks = [
+            interpret_answer_with_chatgpt(client, question, answer, semaphore)
+            for question, answer in zip(questions, answers)
+        ]
+        return await asyncio.gather(*tasks)
+
 def calculate_final_score(ratings):
     """
     Convert a list of 10 numeric ratings (1–5) into an overall humility
     score of 1–10, accounting for reverse-scoring on certain items.
     """
-    total_score = 0
-    for i, rating in enumerate(ratings):
-        if i in REVERSE_SCORED:
-            rating = 6 - rating  # invert for reverse-scored
-        total_score += rating
+    ratings = np.asarray(ratings, dtype=np.int64)
+    # Invert reverse-scored items (1->5, 5->1, etc.)
+    total_score = int(np.where(REVERSE_SCORED_MASK, 6 - ratings, ratings).sum())
 
     # Map total_score (10–50) to a final scale of 1–10
     final_score = (total_score / 50) * 10
@@ -102,26 +148,29 @@ def main():
     st.title("Intellectual Humility Chatbot")
 
     st.write("This chatbot will ask you 10 open-ended questions about intellectual humility.")
-    st.write("Answer each question in a sentence or two, then click **Submit** for each.")
-
-    # We’ll store answers in a list
-    user_answers = []
-    for i, question in enumerate(QUESTIONS):
-        st.write(f"**Question {i+1}:** {question}")
-        user_input = st.text_area(f"Your answer to Q{i+1}:", key=f"answer_{i}")
-
-    # Only proceed once user hits a button
-    if st.button("Submit All Answers and Calculate Score"):
-        # For each question, interpret the response with ChatGPT
-        user_ratings = []
+    st.write("Answer each question in a sentence or two, then click **Submit**.")
+
+    # We’ll store answers in a list; the form only reruns the script on submit
+    with st.form("answers"):
+        user_answers = []
         for i, question in enumerate(QUESTIONS):
-            user_input = st.session_state[f"answer_{i}"]  # retrieve the text
+            st.write(f"**Question {i+1}:** {question}")
+            user_input = st.text_area(f"Your answer to Q{i+1}:", key=f"answer_{i}")
+            user_answers.append(user_input)
+
+        submitted = st.form_submit_button("Submit All Answers and Calculate Score")
+
+    # Only proceed once user hits the submit button
+    if submitted:
+        # Interpret all responses with ChatGPT at once
+        user_inputs = []
+        for user_input in user_answers:
             if not user_input.strip():
                 # If any answer is blank, give a default rating
                 user_input = "No answer provided."
-            with st.spinner(f"Interpreting answer for Question {i+1}..."):
-                rating = interpret_answer_with_chatgpt(question, user_input)
-            user_ratings.append(rating)
+            user_inputs.append(user_input)
+        with st.spinner("Interpreting your answers..."):
+            user_ratings = asyncio.run(interpret_all_answers(QUESTIONS, user_inputs))
 
         # Calculate final humility score
         final_score = calculate_final_score(user_ratings)
@@ -130,8 +179,5 @@ def main():
         st.subheader(f"Your Intellectual Humility Score: {final_score}/10")
         st.write(advice)
 
-# Set the API key from Streamlit secrets
-openai.api_key = st.secrets["OPENAI_API_KEY"]
-
 if __name__ == "__main__":
     main()
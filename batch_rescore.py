@@ -0,0 +1,165 @@
+import os
+import re
+import sys
+import time
+import orjson
+import streamlit as st
+from openai import OpenAI
+
+from scoring import QUESTIONS, build_rating_request, parse_ratings, calculate_final_score, truncate_answer
+
+# =========================
+# Offline re-scoring with the OpenAI Batch API
+# =========================
+# Re-rates every saved responses file in one Batch API job, which is billed at
+# half the synchronous price and does not count against the app's rate limits.
+# Reads OPENAI_API_KEY from the same Streamlit secrets as the app.
+#
+# Usage: python batch_rescore.py [responses_dir]
+#
+POLL_INTERVAL_SECONDS = 60
+
+def parse_responses_file(path):
+    """
+    Read a responses file written by the app and return its (questions, answers).
+    Answers may span several lines; blank answers become "No answer provided."
+    as they do in the app.
+    """
+    questions = []
+    answers = []
+    answer_lines = None
+    with open(path, encoding="utf-8") as f:
+        for line in f.read().splitlines():
+            question_match = re.match(r"Q\d+: (.*)", line)
+            if question_match or line.startswith("Final Score:"):
+                if answer_lines is not None:
+                    answers.append("\n".join(answer_lines).strip() or "No answer provided.")
+                    answer_lines = None
+                if question_match:
+                    questions.append(question_match.group(1))
+            elif line.startswith("Answer: ") or line == "Answer:":
+                answer_lines = [line[len("Answer: "):]]
+            elif answer_lines is not None:
+                answer_lines.append(line)
+    if answer_lines is not None:
+        answers.append("\n".join(answer_lines).strip() or "No answer provided.")
+    return questions, answers
+
+def build_batch_jsonl(records, path="batch_input.jsonl"):
+    """
+    Write one Batch API request line per submission, using the same request
+    body the app sends, and return the path of the JSONL file.
+    - `records`: dict mapping submission name -> (questions, answers)
+    """
+    with open(path, "wb") as f:
+        for submission, (questions, answers) in records.items():
+            request = {
+                "custom_id": submission,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": build_rating_request(questions, [truncate_answer(answer) for answer in answers]),
+            }
+            # logit_bias is keyed by integer token IDs, which orjson only accepts with OPT_NON_STR_KEYS
+            f.write(orjson.dumps(request, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE))
+    return path
+
+def submit_batch(client, jsonl_path):
+    """
+    Upload the JSONL file and start a batch job over it. Returns the batch ID.
+    """
+    with open(jsonl_path, "rb") as f:
+        input_file = client.files.create(file=f, purpose="batch")
+
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
+    )
+    return batch.id
+
+def wait_for_batch(client, batch_id):
+    """
+    Poll the batch job until it finishes and return its final state.
+    """
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        if batch.status in ("completed", "failed", "expired", "cancelled"):
+            return batch
+        print(f"Batch {batch_id} is {batch.status}, checking again in {POLL_INTERVAL_SECONDS}s...")
+        time.sleep(POLL_INTERVAL_SECONDS)
+
+def download_results(client, file_id):
+    """
+    Download a batch output or error file and return its parsed JSONL lines,
+    or an empty list if the batch produced no such file.
+    """
+    if file_id is None:
+        return []
+    content = client.files.content(file_id)
+    return [orjson.loads(line) for line in content.text.splitlines()]
+
+def collect_ratings(results, records):
+    """
+    Turn batch result lines into two dicts keyed by submission name: the list
+    of ratings (None where the reply could not be parsed), and an error message
+    for each submission whose request failed.
+    """
+    ratings = {}
+    errors = {}
+    for result in results:
+        submission = result["custom_id"]
+        num_questions = len(records[submission][0])
+        response = result.get("response") or {}
+        if result.get("error") or response.get("status_code") != 200:
+            error = result.get("error") or response.get("body", {}).get("error") or {}
+            ratings[submission] = [None] * num_questions
+            errors[submission] = error.get("message", f"status {response.get('status_code')}")
+            continue
+        raw_answer = response["body"]["choices"][0]["message"]["content"]
+        ratings[submission] = parse_ratings(raw_answer, num_questions)
+    return ratings, errors
+
+def main():
+    responses_dir = sys.argv[1] if len(sys.argv) > 1 else "responses"
+    client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+
+    records = {}
+    for file_name in sorted(os.listdir(responses_dir)):
+        if file_name.endswith(".txt"):
+            submission = os.path.splitext(file_name)[0]
+            records[submission] = parse_responses_file(os.path.join(responses_dir, file_name))
+    if not records:
+        print(f"No responses files found in {responses_dir}.")
+        return
+
+    jsonl_path = build_batch_jsonl(records)
+    batch_id = submit_batch(client, jsonl_path)
+    print(f"Submitted batch {batch_id} with {len(records)} submissions.")
+
+    batch = wait_for_batch(client, batch_id)
+    if batch.status != "completed":
+        print(f"Batch {batch_id} ended with status {batch.status}.")
+        return
+
+    # A completed batch whose requests all failed has no output file, only an error file
+    results = download_results(client, batch.output_file_id) + download_results(client, batch.error_file_id)
+    ratings, errors = collect_ratings(results, records)
+    if batch.error_file_id is not None:
+        print(f"{len(errors)} requests failed; see batch error file {batch.error_file_id}.")
+
+    for submission, (questions, _) in records.items():
+        if submission in errors:
+            print(f"{submission}: failed ({errors[submission]})")
+            continue
+        submission_ratings = ratings.get(submission)
+        if submission_ratings is None:
+            print(f"{submission}: no result in the batch output")
+            continue
+        line = f"{submission}: ratings {submission_ratings}"
+        # Only submissions to the current questionnaire can be scored with its reverse-scoring
+        if list(questions) == list(QUESTIONS) and None not in submission_ratings:
+            line += f", score {calculate_final_score(submission_ratings)}/10"
+        print(line)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import functools
+import numpy as np
+import tiktoken
+
+# =========================
+# Intellectual Humility questionnaire and rating prompt
+# =========================
+# Shared by the app and batch_rescore.py. Kept free of secrets so the offline
+# tools can import it without the app's GitHub credentials.
+#
+QUESTIONS = (
+    "Can you describe a time you realized you were wrong about something important? How did you come to that realization, and what did you do afterward?",
+    "What’s a topic you used to feel very certain about, but now feel less certain—or even uncertain—about? What made you reconsider?",
+    "When you’re in a debate and you encounter evidence that contradicts your view, how do you usually respond?",
+    "In areas you’re most knowledgeable about, do you ever worry that you might still have blind spots? How do you watch out for them?",
+    "How do you decide which sources of information you trust and which you don’t?"
+    # "I enjoy learning from people whose opinions differ from mine.",
+    # "I find it easy to admit when I’m wrong.",
+    # "I’m open to revisiting and potentially changing my core beliefs.",
+    # "I often seek feedback and constructive criticism.",
+    # "I quickly dismiss opposing viewpoints.",  # reverse scored
+    # "I find it difficult to say 'I don’t know.'",  # reverse scored
+    # "I value expertise in areas where I’m not knowledgeable.",
+    # "I try to see issues from multiple perspectives.",
+    # "It is important to me to be right, even if evidence suggests otherwise.",  # reverse scored
+    # "I regularly reflect on how my beliefs may be biased or incomplete."
+)
+REVERSE_SCORED = frozenset()
+# REVERSE_SCORED = frozenset({4, 5, 8})  # 0-based indices for Q5, Q6, Q9
+
+SYSTEM_MESSAGE = (
+    "You are a helpful assistant. You will be given a numbered list of questions that should help you identify intellectual humility "
+    "and the user's answer to each. Use the following definition of intellectual humility: Intellectual humility is the "
+    "recognition that our knowledge and understanding are always limited and subject to growth or change." 
+    "It involves acknowledging that we can be wrong, while staying open to learning from new information or perspectives."
+    "Individuals who exhibit intellectual humility demonstrate curiosity, actively seeking out opposing viewpoints to refine their own thinking."
+    "They also tend to be self-reflective about their cognitive biases and willing to correct mistakes in pursuit of truth."
+    "In essence, intellectual humility emphasizes understanding over ego, valuing the collaborative search for accuracy above the need to be right."
+    "Your task: interpret how each of the user’s answers reflects "
+    "their intellectual humility on a 1–5 scale, with 1 = strongly indicates lack of humility "
+    "and 5 = strongly indicates humility. Rate each answer independently of the others."
+)
+
+# Boolean mask over question indices marking the reverse-scored items
+REVERSE_SCORED_MASK = np.zeros(len(QUESTIONS), dtype=bool)
+REVERSE_SCORED_MASK[list(REVERSE_SCORED)] = True
+
+CHAT_MODEL = "gpt-3.5-turbo"
+
+# cl100k token IDs for "1".."5"; biasing them to +100 makes them the only
+# tokens the model can emit, so each rating costs exactly one output token
+RATING_TOKEN_IDS = [16, 17, 18, 19, 20]
+
+# Answers are cut to this many tokens before rating, so a pasted essay
+# costs no more than a long answer
+MAX_ANSWER_TOKENS = 200
+
+def build_rating_request(questions, answers):
+    """
+    Build the ChatCompletion parameters asking the model to rate every answer on a
+    1–5 scale where 1 = strongly indicates lack of humility, 5 = strongly indicates humility.
+    Output is restricted to exactly one digit token per answer.
+    """
+    numbered_answers = "\n".join(
+        f"{i+1}. Question: {question}\n   User's answer: '{answer}'"
+        for i, (question, answer) in enumerate(zip(questions, answers))
+    )
+    if len(questions) == 1:
+        instructions = "Please respond ONLY with 1 digit from 1 to 5."
+    else:
+        instructions = (
+            f"Please respond ONLY with {len(questions)} digits from 1 to 5, "
+            "one per answer, in the same order, with nothing between them."
+        )
+    user_prompt = f"{numbered_answers}\n\n{instructions}"
+    return {
+        "model": CHAT_MODEL,
+        "messages": [
+            {"role": "system", "content": SYSTEM_MESSAGE},
+            {"role": "user", "content": user_prompt},
+        ],
+        "temperature": 0.0,
+        "max_tokens": len(questions),
+        "logit_bias": {token_id: 100 for token_id in RATING_TOKEN_IDS},
+    }
+
+def parse_ratings(raw_answer, num_ratings):
+    """
+    Parse the model's reply of one digit per answer into `num_ratings` ratings,
+    or all None if the reply is cut short.
+    """
+    digits = raw_answer.strip()
+    if len(digits) != num_ratings:
+        return [None] * num_ratings
+    return [int(digit) if digit in "12345" else None for digit in digits]
+
+@functools.lru_cache(maxsize=None)
+def get_tokenizer():
+    """
+    Return the tiktoken encoding for CHAT_MODEL, built once per process.
+    """
+    return tiktoken.encoding_for_model(CHAT_MODEL)
+
+def truncate_answer(answer):
+    """
+    Cut an answer down to its first MAX_ANSWER_TOKENS tokens.
+    """
+    tokenizer = get_tokenizer()
+    tokens = tokenizer.encode(answer)
+    if len(tokens) <= MAX_ANSWER_TOKENS:
+        return answer
+    return tokenizer.decode(tokens[:MAX_ANSWER_TOKENS])
+
+def calculate_final_score(ratings):
+    """
+    Convert a list of 10 numeric ratings (1–5) into an overall humility
+    score (1–10), accounting for reverse-scoring on certain items.
+    """
+    ratings = np.asarray(ratings, dtype=np.int64)
+    # Invert reverse-scored items (1->5, 5->1, etc.)
+    total_score = int(np.where(REVERSE_SCORED_MASK, 6 - ratings, ratings).sum())
+
+    # Now map total_score (10–50) to a scale of 1–10
+    final_score = (total_score / 25) * 10
+    return round(final_score, 1)